@@ -20,6 +20,10 @@ echo "  S3_BUCKET: $S3_BUCKET"
 echo "  AWS_REGION: ${AWS_REGION:-us-east-1}"
 echo "  MAX_AGE_DAYS: ${MAX_AGE_DAYS:-7}"
 echo "  MAX_SIZE_MB: ${MAX_SIZE_MB:-100}"
+echo "  GZIP_LEVEL: ${GZIP_LEVEL:-1}"
+echo "  COMPRESS_THREADS: ${COMPRESS_THREADS:-auto}"
+echo "  WATCH_LOGS: ${WATCH_LOGS:-true}"
+echo "  SCAN_INTERVAL_HOURS: ${SCAN_INTERVAL_HOURS:-1}"
 
 # Start the log processor
 exec python log_processor.py
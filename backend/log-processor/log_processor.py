@@ -2,100 +2,452 @@
 
 import os
 import time
+import errno
 import gzip
 import shutil
 import logging
+import subprocess
 from datetime import datetime, timedelta
 from pathlib import Path
 import schedule
 
+# Optional: ISA-L accelerated gzip, same file API as the stdlib module
+try:
+    from isal import igzip
+except ImportError:
+    igzip = None
+
+# Optional: inotify-driven rotation instead of relying only on periodic scans
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+# Optional: io_uring batched unlinks and fsyncs
+try:
+    import liburing
+except ImportError:
+    liburing = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+logging.getLogger('watchfiles').setLevel(logging.WARNING)
+
+# Read/write chunk size used when compressing rotated logs
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Highest compression level supported by ISA-L
+ISAL_MAX_LEVEL = 3
+
+# Leading bytes of every gzip stream
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Longest the watcher blocks without events before running due scheduled jobs
+WATCH_TIMEOUT_MS = 300 * 1000
+
+# Number of operations submitted to io_uring per batch
+IO_URING_BATCH_SIZE = 64
+
+# io_uring opcodes from the kernel ABI - the liburing bindings do not export them
+IORING_OP_FSYNC = 3
+IORING_OP_UNLINKAT = 36  # Linux 5.11+
+
+def _walk_files(root):
+    """Yield a DirEntry for every regular file under root, without following symlinks"""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except OSError as e:
+            # Unreadable or vanished directories are skipped, as rglob did
+            logger.warning(f"Skipping directory {directory}: {e}")
+
+def _available_cpus():
+    """Count the CPUs this process may actually use, honouring cgroup CPU quotas"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: quota is -1 when unlimited
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                quota = f.read().strip()
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = f.read().strip()
+        except OSError:
+            return cpus
+    
+    if quota in ('max', '-1'):
+        return cpus
+    return max(1, min(cpus, int(quota) // int(period)))
+
+def _fadvise(fd, path, advice_name):
+    """Apply a posix_fadvise hint to an open file where the platform supports it"""
+    advice = getattr(os, advice_name, None)
+    if advice is None:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, advice)
+    except OSError as e:
+        logger.debug(f"posix_fadvise {advice_name} failed on {path}: {e}")
+
+def _io_uring_batch(items, prep_name, opcode, fallback):
+    """Apply one operation to every item, returning {item: OSError} for failures
+
+    Operations are submitted through io_uring in batches when liburing is
+    available and the kernel supports opcode (prep_name names the matching
+    liburing prep function), otherwise fallback is called on each item in turn.
+    """
+    errors = {}
+    ring = liburing.Ring() if liburing is not None else None
+    if ring is not None:
+        try:
+            liburing.io_uring_queue_init(IO_URING_BATCH_SIZE, ring)
+        except OSError as e:
+            # io_uring may be disabled by the kernel or a seccomp profile
+            logger.debug(f"io_uring unavailable, running {fallback.__name__} one by one: {e}")
+            ring = None
+
+    if ring is not None:
+        # Older kernels open the ring but fail every request for newer opcodes
+        probe = None
+        try:
+            probe = liburing.io_uring_get_probe_ring(ring)
+            supported = probe is not None and liburing.io_uring_opcode_supported(probe, opcode)
+        except OSError:
+            supported = False
+        finally:
+            if probe is not None:
+                liburing.io_uring_free_probe(probe)
+        if not supported:
+            logger.debug(f"io_uring lacks {prep_name}, running {fallback.__name__} one by one")
+            liburing.io_uring_queue_exit(ring)
+            ring = None
+
+    if ring is None:
+        for item in items:
+            try:
+                fallback(item)
+            except OSError as e:
+                errors[item] = e
+        return errors
+
+    prep = getattr(liburing, prep_name)
+    cqe = liburing.Cqe()
+    try:
+        for start in range(0, len(items), IO_URING_BATCH_SIZE):
+            batch = items[start:start + IO_URING_BATCH_SIZE]
+            for index, item in enumerate(batch):
+                sqe = liburing.io_uring_get_sqe(ring)
+                prep(sqe, item)
+                liburing.io_uring_sqe_set_data64(sqe, index)
+            liburing.io_uring_submit_and_wait(ring, len(batch))
+
+            for _ in batch:
+                liburing.io_uring_wait_cqe(ring, cqe)
+                completion = cqe[0]
+                item = batch[completion.user_data]
+                try:
+                    # Reading res raises the matching OSError for a failed operation
+                    completion.res
+                except OSError as e:
+                    errors[item] = e
+                finally:
+                    liburing.io_uring_cqe_seen(ring, completion)
+    finally:
+        liburing.io_uring_queue_exit(ring)
+
+    # The probe can pass while the operation is still refused for this file,
+    # so retry those items the plain way rather than reporting them as failed
+    for item, e in list(errors.items()):
+        if e.errno in (errno.EINVAL, errno.EOPNOTSUPP):
+            try:
+                fallback(item)
+                del errors[item]
+            except OSError as retry_error:
+                errors[item] = retry_error
+    return errors
+
+def _unlink_batch(paths):
+    """Delete paths, returning {path: OSError} for those that failed"""
+    return _io_uring_batch(paths, 'io_uring_prep_unlink', IORING_OP_UNLINKAT, os.unlink)
+
+def _fsync_batch(fds):
+    """Flush open file descriptors to disk, returning {fd: OSError} for those that failed"""
+    return _io_uring_batch(fds, 'io_uring_prep_fsync', IORING_OP_FSYNC, os.fsync)
 
 class LogProcessor:
+    _CATEGORIES = ('app', 'auth', 'chat', 'error', 'system', 'websocket')
+
     def __init__(self):
         self.log_path = os.getenv('LOG_PATH', '/var/log/chattingo')
+        self._category_paths = [Path(self.log_path) / category for category in self._CATEGORIES]
         self.max_age_days = int(os.getenv('MAX_AGE_DAYS', '3'))
         self.max_size_mb = int(os.getenv('MAX_SIZE_MB', '50'))
+        self.gzip_level = int(os.getenv('GZIP_LEVEL', '1'))
+        self.scan_interval_hours = int(os.getenv('SCAN_INTERVAL_HOURS', '1'))
+        self.watch_enabled = os.getenv('WATCH_LOGS', 'true').lower() == 'true' and watchfiles is not None
+        
+        # Rotation thresholds in bytes/seconds so scans compare integers directly
+        self.max_size_bytes = self.max_size_mb * 1024 * 1024
+        self.max_age_seconds = self.max_age_days * 24 * 3600
+        
+        # Use pigz for multi-core compression when it is installed and more
+        # than one CPU is available - a single CPU gains nothing over ISA-L
+        compress_threads = os.getenv('COMPRESS_THREADS', 'auto').strip().lower()
+        self.compress_threads = _available_cpus() if compress_threads in ('', 'auto') else int(compress_threads)
+        self.pigz_path = shutil.which('pigz') if self.compress_threads > 1 else None
+        if self.pigz_path:
+            logger.info(f"pigz found at {self.pigz_path} - using parallel compression with {self.compress_threads} threads")
         
-        logger.info(f"LogProcessor initialized - Path: {self.log_path}, Max age: {self.max_age_days} days, Max size: {self.max_size_mb}MB")
+        # Otherwise prefer ISA-L when it supports the requested level
+        if igzip is not None and self.gzip_level <= ISAL_MAX_LEVEL:
+            self.gzip_module = igzip
+        else:
+            self.gzip_module = gzip
+        
+        # (archive, source) pairs whose sources are removed once the archives are on
+        # disk - pairs that fail to sync stay here and are retried the next cycle
+        self._pending_rotations = []
+        
+        logger.info(f"LogProcessor initialized - Path: {self.log_path}, Max age: {self.max_age_days} days, Max size: {self.max_size_mb}MB, Gzip level: {self.gzip_level}, Watch: {self.watch_enabled}")
 
-    def should_rotate_file(self, file_path):
-        """Check if file should be rotated based on size or age"""
+    def should_rotate_entry(self, entry, now):
+        """Check if a scanned file should be rotated based on size or age"""
         try:
-            stat = file_path.stat()
+            stat = entry.stat()
             
             # Check file size
-            size_mb = stat.st_size / (1024 * 1024)
-            if size_mb > self.max_size_mb:
-                logger.info(f"File {file_path.name} exceeds size limit: {size_mb:.2f}MB")
+            if stat.st_size > self.max_size_bytes:
+                logger.info(f"File {entry.name} exceeds size limit: {stat.st_size / (1024 * 1024):.2f}MB")
                 return True
             
             # Check file age
-            age_days = (time.time() - stat.st_mtime) / (24 * 3600)
-            if age_days > self.max_age_days:
-                logger.info(f"File {file_path.name} exceeds age limit: {age_days:.2f} days")
+            age_seconds = now - stat.st_mtime
+            if age_seconds > self.max_age_seconds:
+                logger.info(f"File {entry.name} exceeds age limit: {age_seconds / (24 * 3600):.2f} days")
                 return True
             
             return False
         except Exception as e:
-            logger.error(f"Error checking file {file_path}: {e}")
+            logger.error(f"Error checking file {entry.path}: {e}")
             return False
 
+    def rotate_and_compress(self, source, category_path, timestamp):
+        """Rename a log file with a timestamp suffix and compress it"""
+        # Create timestamped filename
+        source_name = os.path.basename(source)
+        rotated_name = f"{source_name[:-len('.log')]}_{timestamp}.log"
+        rotated_path = category_path / rotated_name
+        
+        # Rename file
+        os.rename(source, rotated_path)
+        logger.info(f"Rotated: {source_name} -> {rotated_name}")
+        
+        # Compress file (keep locally, no S3 upload)
+        compressed_path = self.compress_file(rotated_path)
+        if compressed_path:
+            logger.info(f"Log compressed and stored locally: {compressed_path}")
+        else:
+            logger.warning(f"Failed to compress rotated file: {rotated_path}")
+
     def compress_file(self, source_path):
         """Compress log file using gzip"""
         compressed_path = source_path.with_suffix(source_path.suffix + '.gz')
         
         try:
-            with open(source_path, 'rb') as f_in:
-                with gzip.open(compressed_path, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
+            with open(source_path, 'rb', buffering=COPY_BUFFER_SIZE) as f_in:
+                # pread leaves the file offset and read buffer untouched for the copy below
+                already_compressed = os.pread(f_in.fileno(), len(GZIP_MAGIC), 0) == GZIP_MAGIC
+                
+                if not already_compressed:
+                    with open(compressed_path, 'wb') as f_raw:
+                        _fadvise(f_in.fileno(), source_path, 'POSIX_FADV_SEQUENTIAL')
+                        if self.pigz_path:
+                            # Writing the archive ourselves gives it a fresh mtime (pigz would copy
+                            # the source's, and age-rotated logs would then be deleted at the next cleanup)
+                            subprocess.run(
+                                [self.pigz_path, '-c', f'-{self.gzip_level}', '-p', str(self.compress_threads)],
+                                stdin=f_in,
+                                stdout=f_raw,
+                                check=True
+                            )
+                        else:
+                            with self.gzip_module.open(f_raw, 'wb', compresslevel=self.gzip_level) as f_out:
+                                shutil.copyfileobj(f_in, f_out, length=COPY_BUFFER_SIZE)
+                        
+                        # The source is not read again, so keep it out of the page cache. The
+                        # archive's pages are still dirty here and are dropped after its sync
+                        _fadvise(f_in.fileno(), source_path, 'POSIX_FADV_DONTNEED')
+            
+            if already_compressed:
+                # Already gzip data - renaming moves no bytes. Refresh the mtime so the
+                # archive gets the same retention as a freshly compressed one
+                os.rename(source_path, compressed_path)
+                os.utime(compressed_path)
+                logger.info(f"Already compressed, renamed: {source_path.name} -> {compressed_path.name}")
+                return compressed_path
             
-            # Remove original file
-            source_path.unlink()
+            # Original file is removed by finish_rotations once the archive is synced
+            self._pending_rotations.append((compressed_path, source_path))
             logger.info(f"Compressed: {source_path.name} -> {compressed_path.name}")
             return compressed_path
         except Exception as e:
             logger.error(f"Error compressing {source_path}: {e}")
             return None
 
-
-
-    def process_category(self, category):
-        """Process log files for a specific category"""
-        category_path = Path(self.log_path) / category
+    def finish_rotations(self):
+        """Sync pending archives to disk in one batch, then remove their sources"""
+        if not self._pending_rotations:
+            return
+        pending, self._pending_rotations = self._pending_rotations, []
+        
+        # Sync each archive and its directory so the new entries survive a crash
+        sync_paths = [str(archive) for archive, _ in pending]
+        sync_paths += sorted({str(archive.parent) for archive, _ in pending})
+        
+        failed = set()
+        fds = {}
+        try:
+            for path in sync_paths:
+                try:
+                    fds[os.open(path, os.O_RDONLY)] = path
+                except FileNotFoundError:
+                    # Archive already uploaded and removed - nothing left to sync
+                    continue
+                except OSError as e:
+                    logger.warning(f"Failed to open {path} for sync: {e}")
+                    failed.add(path)
+            
+            for fd, e in _fsync_batch(list(fds)).items():
+                logger.warning(f"Failed to sync {fds[fd]}: {e}")
+                failed.add(fds[fd])
+            
+            # Synced archive pages are clean now, so the kernel can actually drop them
+            archive_paths = {str(archive) for archive, _ in pending}
+            for fd, path in fds.items():
+                if path in archive_paths and path not in failed:
+                    _fadvise(fd, path, 'POSIX_FADV_DONTNEED')
+        finally:
+            for fd in fds:
+                os.close(fd)
         
+        synced = {}
+        for archive, source in pending:
+            if str(archive) in failed or str(archive.parent) in failed:
+                logger.warning(f"Keeping {source} until {archive} can be synced")
+                self._pending_rotations.append((archive, source))
+            else:
+                synced[str(source)] = (archive, source)
+        
+        for path, e in _unlink_batch(list(synced)).items():
+            if isinstance(e, FileNotFoundError):
+                continue
+            logger.warning(f"Failed to remove rotated file {path}: {e}")
+            self._pending_rotations.append(synced[path])
+
+    def process_category(self, category_path):
+        """Process log files for a specific category directory"""
         if not category_path.exists():
             logger.debug(f"Category directory does not exist: {category_path}")
             return
 
-        # Process .log files
-        for log_file in category_path.glob('*.log'):
-            if self.should_rotate_file(log_file):
-                # Create timestamped filename
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                rotated_name = f"{log_file.stem}_{timestamp}.log"
-                rotated_path = category_path / rotated_name
-                
-                # Rename file
-                log_file.rename(rotated_path)
-                logger.info(f"Rotated: {log_file.name} -> {rotated_name}")
-                
-                # Compress file (keep locally, no S3 upload)
-                compressed_path = self.compress_file(rotated_path)
-                if compressed_path:
-                    logger.info(f"Log compressed and stored locally: {compressed_path}")
-                else:
-                    logger.warning(f"Failed to compress rotated file: {rotated_path}")
+        # Process .log files in a single directory pass
+        with os.scandir(category_path) as it:
+            log_entries = [e for e in it if e.name.endswith('.log') and e.is_file(follow_symlinks=False)]
+        
+        # All files rotated in this pass share one timestamp
+        now = time.time()
+        timestamp = datetime.fromtimestamp(now).strftime('%Y%m%d_%H%M%S')
+        pending_sources = self._pending_sources()
+        
+        for entry in log_entries:
+            # Sources still waiting on their archive's sync are already rotated
+            if entry.path in pending_sources:
+                continue
+            if self.should_rotate_entry(entry, now):
+                self.rotate_and_compress(entry.path, category_path, timestamp)
+
+    def _pending_sources(self):
+        """Paths of rotated sources kept until their archives are synced"""
+        return {str(source) for _, source in self._pending_rotations}
+
+    def process_changed_files(self, changed_paths):
+        """Rotate changed log files that have grown past the size limit"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        pending_sources = self._pending_sources()
+        
+        for changed_path in changed_paths:
+            category_path = Path(changed_path).parent
+            # Only files directly inside a known category directory are live logs
+            if category_path not in self._category_paths:
+                continue
+            
+            # Rotated sources awaiting removal are never rotated again
+            if changed_path in pending_sources:
+                continue
+            
+            try:
+                if os.stat(changed_path).st_size > self.max_size_bytes:
+                    logger.info(f"File {os.path.basename(changed_path)} exceeds size limit")
+                    self.rotate_and_compress(changed_path, category_path, timestamp)
+            except FileNotFoundError:
+                # Already rotated or removed since the event was queued
+                continue
+            except Exception as e:
+                logger.error(f"Error processing changed file {changed_path}: {e}")
+        
+        self.finish_rotations()
+
+    def watch_logs(self):
+        """Rotate logs as soon as they change, running scheduled jobs between events
+
+        Returns when the log directory cannot be watched, leaving the caller
+        to fall back to scheduled scans.
+        """
+        if not os.path.isdir(self.log_path):
+            logger.warning(f"Log directory does not exist, falling back to scheduled scans: {self.log_path}")
+            return
+        
+        logger.info(f"Watching {self.log_path} for log changes")
+        
+        def log_filter(change, path):
+            return change != watchfiles.Change.deleted and path.endswith('.log')
+        
+        try:
+            for changes in watchfiles.watch(
+                self.log_path,
+                watch_filter=log_filter,
+                rust_timeout=WATCH_TIMEOUT_MS,
+                yield_on_timeout=True
+            ):
+                schedule.run_pending()
+                if changes:
+                    self.process_changed_files({path for _, path in changes})
+        except OSError as e:
+            # Missing directory or exhausted inotify watches
+            logger.warning(f"Cannot watch {self.log_path}, falling back to scheduled scans: {e}")
 
     def cleanup_old_files(self):
         """Clean up old log files (aggressive cleanup since no S3 backup)"""
         logger.info(f"Starting cleanup of log files older than {self.max_age_days} days")
-        cutoff_time = time.time() - (self.max_age_days * 24 * 3600)
+        cutoff_time = time.time() - self.max_age_seconds
         deleted_count = 0
         
         log_base_path = Path(self.log_path)
@@ -103,15 +455,22 @@ class LogProcessor:
             logger.warning(f"Log directory does not exist: {log_base_path}")
             return
 
-        for file_path in log_base_path.rglob('*'):
-            if file_path.is_file() and file_path.suffix in ['.log', '.gz']:
+        expired_paths = []
+        for entry in _walk_files(log_base_path):
+            if entry.name.endswith(('.log', '.gz')):
                 try:
-                    if file_path.stat().st_mtime < cutoff_time:
-                        file_path.unlink()
-                        deleted_count += 1
-                        logger.info(f"Deleted old file: {file_path}")
+                    if entry.stat().st_mtime < cutoff_time:
+                        expired_paths.append(entry.path)
                 except Exception as e:
-                    logger.warning(f"Failed to delete {file_path}: {e}")
+                    logger.warning(f"Failed to check {entry.path}: {e}")
+        
+        errors = _unlink_batch(expired_paths)
+        for path in expired_paths:
+            if path in errors:
+                logger.warning(f"Failed to delete {path}: {errors[path]}")
+            else:
+                deleted_count += 1
+                logger.info(f"Deleted old file: {path}")
         
         logger.info(f"Cleanup completed - deleted {deleted_count} old log files")
 
@@ -119,14 +478,13 @@ class LogProcessor:
         """Process logs for all categories"""
         logger.info("Starting log processing cycle")
         
-        categories = ['app', 'auth', 'chat', 'error', 'system', 'websocket']
-        
-        for category in categories:
+        for category_path in self._category_paths:
             try:
-                self.process_category(category)
+                self.process_category(category_path)
             except Exception as e:
-                logger.error(f"Error processing category {category}: {e}")
+                logger.error(f"Error processing category {category_path.name}: {e}")
         
+        self.finish_rotations()
         logger.info("Log processing cycle completed")
 
 def main():
@@ -134,8 +492,8 @@ def main():
     
     processor = LogProcessor()
     
-    # Schedule log processing every hour
-    schedule.every().hour.do(processor.process_all_logs)
+    # Schedule periodic full scans - a safety net for age-based rotation when watching
+    schedule.every(processor.scan_interval_hours).hours.do(processor.process_all_logs)
     
     # Schedule cleanup every day at 2 AM (more aggressive cleanup since no S3 backup)
     schedule.every().day.at("02:00").do(processor.cleanup_old_files)
@@ -145,10 +503,19 @@ def main():
     
     logger.info("Log processor started successfully - no S3 uploads, local compression and cleanup only")
     
-    # Keep the script running
+    # React to filesystem events when watchfiles is available
+    if processor.watch_enabled:
+        processor.watch_logs()
+    
+    # Keep the script running - also the fallback when the log directory cannot be watched
     while True:
         schedule.run_pending()
-        time.sleep(60)  # Check every minute
+        # Sleep until the next job is due instead of polling every minute
+        idle_seconds = schedule.idle_seconds()
+        if idle_seconds is None:
+            break
+        if idle_seconds > 0:
+            time.sleep(min(idle_seconds, 300))
 
 if __name__ == "__main__":
     main()
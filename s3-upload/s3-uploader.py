@@ -12,12 +12,39 @@ import shutil
 import logging
 import boto3
 import yaml
+from boto3.s3.transfer import TransferConfig
 from datetime import datetime, timedelta
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from botocore.compat import HAS_CRT
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import schedule
 import signal
 import sys
+import tarfile
+import tempfile
+import uuid
+import asyncio
+
+# Prefer the libyaml-backed parser when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# Optional: single-threaded asyncio uploads
+try:
+    import aioboto3
+    from aiobotocore.config import AioConfig
+except ImportError:
+    aioboto3 = None
+
+# Optional: inotify-driven uploads instead of relying only on periodic scans
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
 
 # Configure logging
 logging.basicConfig(
@@ -29,6 +56,29 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger('s3-uploader')
+logging.getLogger('watchfiles').setLevel(logging.WARNING)
+
+# Longest the watcher blocks without events before running due scheduled jobs
+WATCH_TIMEOUT_MS = 300 * 1000
+
+# Longest the watcher groups a burst of events before yielding them
+WATCH_DEBOUNCE_MS = 60 * 1000
+
+def _walk_files(root):
+    """Yield a DirEntry for every regular file under root, without following symlinks"""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except OSError as e:
+            # Unreadable or vanished directories are skipped, as rglob did
+            logger.warning(f"Skipping directory {directory}: {e}")
 
 class S3LogUploader:
     def __init__(self, config_path='config/settings.yaml'):
@@ -39,10 +89,60 @@ class S3LogUploader:
         self.aws_region = self.config['s3']['region']
         self.max_age_days = self.config['cleanup']['max_age_days']
         self.check_interval_minutes = self.config['schedule']['check_interval_minutes']
+        self.upload_workers = self.config['schedule'].get('upload_workers', 16)
+        self.batch_uploads = self.config['s3'].get('batch_uploads', False)
+        self.async_uploads = self.config['schedule'].get('async_uploads', False)
+        if self.async_uploads and aioboto3 is None:
+            logger.warning("async_uploads enabled but aioboto3 is not installed - falling back to threaded uploads")
+            self.async_uploads = False
+        self.watch_enabled = self.config['schedule'].get('watch', True) and watchfiles is not None
+        self.settle_seconds = self.config['schedule'].get('settle_seconds', 5)
+        
+        # (mtime, size) of archives already uploaded, so unchanged files kept
+        # locally are not uploaded again on the next cycle
+        self._uploaded_files = {}
+        
+        # CRC32C integrity checksums use the hardware-accelerated awscrt implementation
+        self.checksum_algorithm = self.config['s3'].get('checksum_algorithm', 'CRC32C')
+        if self.checksum_algorithm == 'CRC32C' and not HAS_CRT:
+            logger.warning("CRC32C checksums require awscrt (boto3[crt]) - falling back to CRC32")
+            self.checksum_algorithm = 'CRC32'
+        
+        # ExtraArgs shared by every single-file upload (S3 Standard storage, no Glacier)
+        self._base_extra = {
+            'ContentType': 'application/gzip',
+            'ContentEncoding': 'gzip',
+            'ChecksumAlgorithm': self.checksum_algorithm,
+            'Metadata': {
+                'source': 'chattingo-k8s'
+            }
+        }
+        self.start_cycle()
+        
+        # Shared transfer settings - large archives are split into parts
+        # uploaded in parallel, small files still go out in a single PUT
+        self.transfer_config = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=10,
+            use_threads=True
+        )
+        
+        # Size the connection pool for every worker's multipart threads so
+        # concurrent uploads reuse keep-alive connections instead of queueing
+        client_options = {
+            'max_pool_connections': max(32, self.upload_workers * self.transfer_config.max_concurrency),
+            'retries': {'mode': 'adaptive', 'max_attempts': 5},
+            'tcp_keepalive': True
+        }
+        self.client_config = Config(**client_options)
+        
+        # The asyncio client takes the same settings through aiobotocore's own Config type
+        self.aio_client_config = AioConfig(**client_options) if self.async_uploads else None
         
         # Initialize S3 client
         try:
-            self.s3_client = boto3.client('s3', region_name=self.aws_region)
+            self.s3_client = boto3.client('s3', region_name=self.aws_region, config=self.client_config)
             logger.info(f"S3 client initialized for bucket: {self.s3_bucket}")
             # Test S3 connectivity
             self.s3_client.head_bucket(Bucket=self.s3_bucket)
@@ -55,7 +155,7 @@ class S3LogUploader:
         """Load configuration from YAML file"""
         try:
             with open(config_path, 'r') as f:
-                config = yaml.safe_load(f)
+                config = yaml.load(f, Loader=SafeLoader)
             logger.info(f"Configuration loaded from {config_path}")
             return config
         except Exception as e:
@@ -65,17 +165,30 @@ class S3LogUploader:
                 'log_path': '/var/log/chattingo',
                 's3': {
                     'bucket_name': 'chattingo-logs',
-                    'region': 'us-east-1'
+                    'region': 'us-east-1',
+                    'batch_uploads': False,
+                    'checksum_algorithm': 'CRC32C'
                 },
                 'cleanup': {
                     'max_age_days': 7,
                     'delete_after_upload': True
                 },
                 'schedule': {
-                    'check_interval_minutes': 30
+                    'check_interval_minutes': 30,
+                    'upload_workers': 16,
+                    'async_uploads': False,
+                    'watch': True,
+                    'settle_seconds': 5
                 }
             }
 
+    def start_cycle(self):
+        """Capture the date partition and timestamps shared by all uploads in a cycle"""
+        now = datetime.now()
+        self._cycle_date_str = now.strftime('%Y/%m/%d')
+        self._cycle_timestamp = now.strftime('%Y%m%d_%H%M%S')
+        self._cycle_iso = now.isoformat()
+
     def find_log_files_to_upload(self):
         """Find compressed log files ready for upload"""
         log_base_path = Path(self.log_path)
@@ -84,47 +197,74 @@ class S3LogUploader:
             logger.warning(f"Log directory does not exist: {log_base_path}")
             return []
 
+        # Archives modified this recently may still be being written
+        settle_cutoff = time.time() - self.settle_seconds
+        
         # Find all .gz files (compressed logs ready for upload)
         files_to_upload = []
-        for gz_file in log_base_path.rglob('*.gz'):
-            if gz_file.is_file():
+        uploaded_files = {}
+        for entry in _walk_files(log_base_path):
+            if not entry.name.endswith('.gz'):
+                continue
+            
+            try:
+                stat = entry.stat()
+            except OSError as e:
+                logger.warning(f"Skipping {entry.path}: {e}")
+                continue
+            file_key = (stat.st_mtime, stat.st_size)
+            if self._uploaded_files.get(entry.path) == file_key:
+                uploaded_files[entry.path] = file_key
+                continue
+            if stat.st_mtime > settle_cutoff:
+                logger.debug(f"Skipping recently modified file: {entry.path}")
+                continue
+            
+            file_path = Path(entry.path)
+            files_to_upload.append({
+                'file_path': file_path,
                 # Get category from parent directory
-                category = gz_file.parent.name
-                files_to_upload.append({
-                    'file_path': gz_file,
-                    'category': category,
-                    'size': gz_file.stat().st_size,
-                    'modified': gz_file.stat().st_mtime
-                })
+                'category': file_path.parent.name,
+                'size': stat.st_size,
+                'modified': stat.st_mtime
+            })
+        
+        # Forget archives that have since been removed from disk
+        self._uploaded_files = uploaded_files
         
         return files_to_upload
 
+    def build_upload_args(self, file_info):
+        """Build the S3 key and ExtraArgs for a single file"""
+        file_path = file_info['file_path']
+        category = file_info['category']
+        
+        # Create S3 key with date partition
+        s3_key = f"chattingo-logs/{self._cycle_date_str}/{category}/{file_path.name}"
+        
+        extra_args = {
+            **self._base_extra,
+            'Metadata': {
+                **self._base_extra['Metadata'],
+                'category': category,
+                'upload_time': self._cycle_iso
+            }
+        }
+        return s3_key, extra_args
+
     def upload_to_s3(self, file_info):
         """Upload a single file to S3"""
         file_path = file_info['file_path']
-        category = file_info['category']
         
         try:
-            # Create S3 key with date partition
-            date_str = datetime.now().strftime('%Y/%m/%d')
-            s3_key = f"chattingo-logs/{date_str}/{category}/{file_path.name}"
-            
-            # Upload file to S3 Standard storage (no Glacier)
-            extra_args = {
-                'ContentType': 'application/gzip',
-                'ContentEncoding': 'gzip',
-                'Metadata': {
-                    'source': 'chattingo-k8s',
-                    'category': category,
-                    'upload_time': datetime.now().isoformat()
-                }
-            }
+            s3_key, extra_args = self.build_upload_args(file_info)
             
             self.s3_client.upload_file(
                 str(file_path),
                 self.s3_bucket,
                 s3_key,
-                ExtraArgs=extra_args
+                ExtraArgs=extra_args,
+                Config=self.transfer_config
             )
             
             logger.info(f"Uploaded: {file_path.name} -> s3://{self.s3_bucket}/{s3_key}")
@@ -134,6 +274,80 @@ class S3LogUploader:
             logger.error(f"Failed to upload {file_path}: {e}")
             return False
 
+    async def _upload_one(self, s3, file_info, semaphore):
+        """Upload a single file to S3 using an asyncio client"""
+        file_path = file_info['file_path']
+        
+        async with semaphore:
+            try:
+                s3_key, extra_args = self.build_upload_args(file_info)
+                
+                await s3.upload_file(
+                    str(file_path),
+                    self.s3_bucket,
+                    s3_key,
+                    ExtraArgs=extra_args,
+                    Config=self.transfer_config
+                )
+                
+                logger.info(f"Uploaded: {file_path.name} -> s3://{self.s3_bucket}/{s3_key}")
+                return True
+                
+            except Exception as e:
+                logger.error(f"Failed to upload {file_path}: {e}")
+                return False
+
+    async def _upload_all(self, files_to_upload):
+        """Upload files concurrently from a single event loop"""
+        async with aioboto3.Session().client('s3', region_name=self.aws_region, config=self.aio_client_config) as s3:
+            semaphore = asyncio.Semaphore(self.upload_workers)
+            return await asyncio.gather(
+                *[self._upload_one(s3, file_info, semaphore) for file_info in files_to_upload]
+            )
+
+    def upload_batch_to_s3(self, category, batch):
+        """Upload all archives of one category to S3 as a single tar object"""
+        log_base_path = Path(self.log_path)
+        
+        try:
+            # The timestamp only has one-second resolution, so add a random suffix
+            # to stop two cycles in the same second from overwriting each other
+            s3_key = f"chattingo-logs/{self._cycle_date_str}/{category}/batch_{self._cycle_timestamp}_{uuid.uuid4().hex}.tar"
+            
+            extra_args = {
+                'ContentType': 'application/x-tar',
+                'ChecksumAlgorithm': self.checksum_algorithm,
+                'Metadata': {
+                    'source': 'chattingo-k8s',
+                    'category': category,
+                    'file_count': str(len(batch)),
+                    'upload_time': self._cycle_iso
+                }
+            }
+            
+            # Members are already gzip-compressed, so the tar itself is left uncompressed
+            with tempfile.TemporaryFile() as buffer:
+                with tarfile.open(fileobj=buffer, mode='w') as tar:
+                    for file_info in batch:
+                        file_path = file_info['file_path']
+                        tar.add(str(file_path), arcname=str(file_path.relative_to(log_base_path)))
+                buffer.seek(0)
+                
+                self.s3_client.upload_fileobj(
+                    buffer,
+                    self.s3_bucket,
+                    s3_key,
+                    ExtraArgs=extra_args,
+                    Config=self.transfer_config
+                )
+            
+            logger.info(f"Uploaded batch of {len(batch)} {category} files -> s3://{self.s3_bucket}/{s3_key}")
+            return True
+            
+        except (ClientError, OSError, tarfile.TarError) as e:
+            logger.error(f"Failed to upload {category} batch: {e}")
+            return False
+
     def cleanup_uploaded_file(self, file_path):
         """Delete local file after successful upload"""
         if self.config['cleanup']['delete_after_upload']:
@@ -153,21 +367,62 @@ class S3LogUploader:
         if not log_base_path.exists():
             return
 
-        for file_path in log_base_path.rglob('*'):
-            if file_path.is_file() and file_path.suffix in ['.log', '.gz']:
+        expired_paths = []
+        for entry in _walk_files(log_base_path):
+            if entry.name.endswith(('.log', '.gz')):
                 try:
-                    if file_path.stat().st_mtime < cutoff_time:
-                        file_path.unlink()
-                        deleted_count += 1
-                        logger.info(f"Deleted old file: {file_path}")
+                    if entry.stat().st_mtime < cutoff_time:
+                        expired_paths.append(entry.path)
                 except Exception as e:
-                    logger.warning(f"Failed to delete {file_path}: {e}")
+                    logger.warning(f"Failed to check {entry.path}: {e}")
+        
+        for path in expired_paths:
+            try:
+                os.unlink(path)
+                deleted_count += 1
+                logger.info(f"Deleted old file: {path}")
+            except Exception as e:
+                logger.warning(f"Failed to delete {path}: {e}")
         
         logger.info(f"Cleanup completed - deleted {deleted_count} old files")
 
+    def upload_files(self, files_to_upload):
+        """Upload files using the configured mode, yielding (batch, uploaded) pairs"""
+        if self.async_uploads and not self.batch_uploads:
+            results = asyncio.run(self._upload_all(files_to_upload))
+            for file_info, uploaded in zip(files_to_upload, results):
+                yield [file_info], uploaded
+            return
+        
+        # Uploads are network-bound, so overlap them across a worker pool
+        with ThreadPoolExecutor(max_workers=self.upload_workers) as executor:
+            if self.batch_uploads:
+                batches = {}
+                for file_info in files_to_upload:
+                    batches.setdefault(file_info['category'], []).append(file_info)
+                futures = {
+                    executor.submit(self.upload_batch_to_s3, category, batch): batch
+                    for category, batch in batches.items()
+                }
+            else:
+                futures = {
+                    executor.submit(self.upload_to_s3, file_info): [file_info]
+                    for file_info in files_to_upload
+                }
+            
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    uploaded = future.result()
+                except Exception as e:
+                    logger.error(f"Unexpected error uploading {batch[0]['file_path']}: {e}")
+                    uploaded = False
+                yield batch, uploaded
+
     def process_logs(self):
         """Main processing function - find and upload logs"""
         logger.info("Starting log upload cycle")
+        self.start_cycle()
         
         try:
             files_to_upload = self.find_log_files_to_upload()
@@ -179,24 +434,60 @@ class S3LogUploader:
             logger.info(f"Found {len(files_to_upload)} files to upload")
             
             upload_count = 0
-            for file_info in files_to_upload:
-                if self.upload_to_s3(file_info):
-                    self.cleanup_uploaded_file(file_info['file_path'])
-                    upload_count += 1
-                else:
-                    logger.warning(f"Skipping cleanup for failed upload: {file_info['file_path']}")
+            for batch, uploaded in self.upload_files(files_to_upload):
+                for file_info in batch:
+                    if uploaded:
+                        self._uploaded_files[str(file_info['file_path'])] = (file_info['modified'], file_info['size'])
+                        self.cleanup_uploaded_file(file_info['file_path'])
+                        upload_count += 1
+                    else:
+                        logger.warning(f"Skipping cleanup for failed upload: {file_info['file_path']}")
             
             logger.info(f"Upload cycle completed - {upload_count}/{len(files_to_upload)} files uploaded")
             
         except Exception as e:
             logger.error(f"Error during log processing: {e}")
 
+    def watch_for_archives(self):
+        """Upload as soon as new archives settle, running scheduled jobs between events
+
+        Returns when the log directory cannot be watched, leaving the caller
+        to fall back to scheduled scans.
+        """
+        if not os.path.isdir(self.log_path):
+            logger.warning(f"Log directory does not exist, falling back to scheduled scans: {self.log_path}")
+            return
+        
+        logger.info(f"Watching {self.log_path} for new compressed logs")
+        
+        def archive_filter(change, path):
+            return change != watchfiles.Change.deleted and path.endswith('.gz')
+        
+        try:
+            # Yield only once the tree has been quiet for settle_seconds
+            for changes in watchfiles.watch(
+                self.log_path,
+                watch_filter=archive_filter,
+                debounce=WATCH_DEBOUNCE_MS,
+                step=self.settle_seconds * 1000,
+                rust_timeout=WATCH_TIMEOUT_MS,
+                yield_on_timeout=True
+            ):
+                schedule.run_pending()
+                if changes:
+                    self.process_logs()
+        except OSError as e:
+            # Missing directory or exhausted inotify watches
+            logger.warning(f"Cannot watch {self.log_path}, falling back to scheduled scans: {e}")
+
     def run(self):
         """Run the uploader service"""
         logger.info("Starting Chattingo S3 Log Uploader Service")
         logger.info(f"Monitoring: {self.log_path}")
         logger.info(f"S3 Bucket: {self.s3_bucket}")
         logger.info(f"Check interval: {self.check_interval_minutes} minutes")
+        logger.info(f"Watch mode: {'enabled' if self.watch_enabled else 'disabled'}")
+        logger.info(f"Upload workers: {self.upload_workers} ({'asyncio' if self.async_uploads else 'threads'})")
         
         # Schedule periodic tasks
         schedule.every(self.check_interval_minutes).minutes.do(self.process_logs)
@@ -215,9 +506,18 @@ class S3LogUploader:
         
         # Main loop
         try:
+            # React to filesystem events when watchfiles is available
+            if self.watch_enabled:
+                self.watch_for_archives()
+            
             while True:
                 schedule.run_pending()
-                time.sleep(60)  # Check every minute
+                # Sleep until the next job is due instead of polling every minute
+                idle_seconds = schedule.idle_seconds()
+                if idle_seconds is None:
+                    break
+                if idle_seconds > 0:
+                    time.sleep(min(idle_seconds, 300))
         except KeyboardInterrupt:
             logger.info("Service stopped by user")
         except Exception as e: